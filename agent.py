@@ -2,6 +2,7 @@ import os
 import sys
 import time, math
 import argparse
+import threading
 import logging
 import json
 import pyautogui
@@ -9,11 +10,28 @@ import anthropic
 import yaml
 import base64
 from anthropic.types.beta import BetaToolUnionParam
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from datetime import datetime, timezone
 from pathlib import Path
 from io import BytesIO
-from py2neo import Graph, Node, Relationship
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from py2neo import Graph
+
+try:
+    import mss
+except ImportError:
+    mss = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
 
 # ------------------------------------------------------------------
 # Konfiguration
@@ -22,11 +40,24 @@ from py2neo import Graph, Node, Relationship
 pyautogui.FAILSAFE = True
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", "./screenshots")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
-SYSTEM_PROMPT = f"""<SYSTEM_CAPABILITIES>
+_SCT = mss.mss() if mss is not None else None
+_json_loads = orjson.loads if orjson is not None else json.loads
+_IO_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="screenshot-io")
+_IO_SLOTS = threading.BoundedSemaphore(8)
+SETTLE_DELAYS = {
+    "mouse_move": 0.0,
+    "left_click": 0.02,
+    "right_click": 0.02,
+    "double_click": 0.02,
+    "key": 0.02,
+    "type": 0.05,
+    "scroll": 0.05,
+}
+SYSTEM_PROMPT_TEMPLATE = """<SYSTEM_CAPABILITIES>
 1. Mit dem Tool 'computer' kannst du den Bildschirm bedienen.
 2. Antworte **nur** mit gueltigem JSON, das exakt dem Schema des Tools entspricht.
 3. Vermeide jeden Klartext außerhalb des JSON-Blocks.
-4. Aktuelles Datum: {datetime.today().strftime('%A, %B %#d, %Y')}
+4. Aktuelles Datum: {date}
 </SYSTEM_CAPABILITIES>
 
 <ENVIRONMENT>
@@ -51,6 +82,12 @@ MODEL = "claude-sonnet-4-20250514"
 COMPUTER_TYPE = "computer_20250124"
 PROCESSSTEP_ID = 0
 PROCESSSTEP = 0
+HISTORY_KEEP = 60
+HISTORY_TRIM_AT = 80
+IMAGE_PLACEHOLDER = {"type": "text", "text": "[älterer Screenshot entfernt]"}
+_STEP_DESC: Dict[str, str] = {}
+_NEXT_OF: Dict[str, str] = {}
+_PREV_OF: Dict[str, str] = {}
 
 # ------------------------------------------------------------------
 # Graph-DB Methoden
@@ -73,35 +110,43 @@ def import_steps(yaml_path: str | Path, graph: Graph, db: str | None = None) ->
     Aus
     ---
     None
-        Die Funktion hat keinen Rückgabewert; sie führt den Import nur aus.
+        Die Funktion hat keinen Rückgabewert; sie führt den Import aus und hält die Schritte zusätzlich im Speicher für ``get_prev_step``, ``get_next_step`` und ``get_curr_step`` vor.
     """
 
     with open(yaml_path, "r", encoding="utf-8") as f:
-        content = f.read().expandtabs(4)
-        data = yaml.safe_load(content)
+        content = f.read()
+
+    # PyYAML lehnt Tabs in Einrückung und ungequoteten Werten ab; ohne Tabs wird nicht kopiert
+    if "\t" in content:
+        content = content.expandtabs(4)
+    data = yaml.load(content, Loader=_YamlLoader)
 
     steps = data["steps"] if isinstance(data, dict) and "steps" in data else data
     if not isinstance(steps, list):
         raise ValueError("YAML muss eine Liste oder ein Dict mit Schlüssel 'steps' sein.")
 
+    rows = [{"id": str(s["id"]), "description": s.get("description", "")} for s in steps]
+    edges = [{"src": str(s["id"]), "dst": str(s["next"])} for s in steps if s.get("next") is not None]
+
+    ids = {r["id"] for r in rows}
+    unknown = sorted({e["dst"] for e in edges if e["dst"] not in ids})
+    if unknown:
+        raise ValueError(f"YAML verweist mit 'next' auf unbekannte Schritte: {', '.join(unknown)}")
+
+    # Je eine parametrisierte Abfrage für Knoten und Kanten statt eines Round-Trips pro Schritt
     tx = graph.begin()
     try:
-        nodes: Dict[str, Node] = {}
-
-        for s in steps:
-            n = Node(
-                "Step",
-                id=str(s["id"]),
-                description=s.get("description", "")
-            )
-            tx.merge(n, "Step", "id")
-            nodes[str(s["id"])] = n
-
-        for s in steps:
-            nxt = s.get("next")
-            if nxt is not None:
-                rel = Relationship(nodes[str(s["id"])] , "NEXT", nodes[str(nxt)])
-                tx.merge(rel)
+        tx.run("""
+            UNWIND $rows AS r
+            MERGE (s:Step {id: r.id})
+            SET s.description = r.description
+        """, rows=rows)
+
+        tx.run("""
+            UNWIND $edges AS e
+            MATCH (a:Step {id: e.src}), (b:Step {id: e.dst})
+            MERGE (a)-[:NEXT]->(b)
+        """, edges=edges)
 
         graph.commit(tx)
         print(f"{len(steps)} Steps importiert.")
@@ -109,6 +154,39 @@ def import_steps(yaml_path: str | Path, graph: Graph, db: str | None = None) ->
         graph.rollback(tx)
         raise
 
+    # Der Graph ändert sich während eines Laufs nicht; Lesezugriffe laufen daher über Dicts
+    _STEP_DESC.clear()
+    _STEP_DESC.update((r["id"], r["description"]) for r in rows)
+    _NEXT_OF.clear()
+    _NEXT_OF.update((e["src"], e["dst"]) for e in edges)
+    _PREV_OF.clear()
+    _PREV_OF.update((dst, src) for src, dst in _NEXT_OF.items())
+
+
+def _lookup_step(step_id: int, links: Optional[Dict[str, str]]) -> Optional[Tuple[int, str]]:
+
+    """
+    Sucht einen Schritt in den per ``import_steps`` geladenen Dicts.
+
+    Ein
+    ---
+    step_id : int
+        ID des Ausgangs‑«Step»‑Knotens.
+    links : dict[str, str] | None
+        ``_PREV_OF`` bzw. ``_NEXT_OF``; ``None`` für den Schritt selbst.
+
+    Aus
+    ---
+    tuple(int, str) | None
+        (ID, Beschreibung) des gesuchten Schritts oder ``None``, falls er nicht existiert oder nichts importiert wurde.
+    """
+
+    sid = str(step_id)
+    target = links.get(sid) if links is not None else sid
+    if target not in _STEP_DESC:
+        return None
+    return int(target), _STEP_DESC[target]
+
 
 def get_prev_step(graph: Graph, step_id: int) -> Tuple[int, str]:
 
@@ -118,7 +196,7 @@ def get_prev_step(graph: Graph, step_id: int) -> Tuple[int, str]:
     Ein
     ---
     graph : Graph
-        Aktive Neo4j‑Verbindung.
+        Neo4j‑Verbindung; wird nicht gelesen, da die Schritte seit ``import_steps`` im Speicher liegen.
     step_id : int
         ID des aktuellen «Step»‑Knotens.
 
@@ -128,16 +206,12 @@ def get_prev_step(graph: Graph, step_id: int) -> Tuple[int, str]:
         (Vorgänger‑ID, Vorgänger‑Beschreibung). Existiert kein expliziter Vorgänger, wird ``(step_id - 1, "Es existiert kein vorheriger Schritt …")`` zurückgegeben.
     """
 
-    q = """
-    MATCH (p:Step)-[:NEXT]->(c:Step {id:$sid})
-    RETURN p.id AS id, p.description AS description
-    """
-    rst = [{"id": r["id"], "description": r["description"]} for r in graph.run(q, sid=str(step_id))]
+    rst = _lookup_step(step_id, _PREV_OF)
 
-    if rst == []:
+    if rst is None:
         return step_id - 1, "Es existiert kein vorheriger Schritt. Gehe zum letzten Schritt zurück."
 
-    return int(rst[0]["id"]), rst[0]["description"]
+    return rst
 
 
 def get_next_step(graph: Graph, step_id: int) -> Tuple[int, str]:
@@ -148,7 +222,7 @@ def get_next_step(graph: Graph, step_id: int) -> Tuple[int, str]:
     Ein
     ---
     graph : Graph
-        Aktive Neo4j‑Verbindung.
+        Neo4j‑Verbindung; wird nicht gelesen, da die Schritte seit ``import_steps`` im Speicher liegen.
     step_id : int
         ID des aktuellen «Step»‑Knotens.
 
@@ -158,16 +232,12 @@ def get_next_step(graph: Graph, step_id: int) -> Tuple[int, str]:
         (Nachfolger‑ID, Nachfolger‑Beschreibung). Falls kein Nachfolger vorhanden ist, wird ``(step_id + 1, "Es existiert kein nachfolgender Schritt …")`` zurückgegeben.
     """
 
-    q = """
-    MATCH (c:Step {id:$sid})-[:NEXT]->(n:Step)
-    RETURN n.id AS id, n.description AS description
-    """
-    rst = [{"id": r["id"], "description": r["description"]} for r in graph.run(q, sid=str(step_id))]
+    rst = _lookup_step(step_id, _NEXT_OF)
 
-    if rst == []:
+    if rst is None:
         return step_id + 1, "Es existiert kein nachfolgender Schritt. Gehe zum letzten Schritt zurück."
 
-    return int(rst[0]["id"]), rst[0]["description"]
+    return rst
 
 def get_curr_step(graph: Graph, step_id: int) -> Tuple[int, str]:
 
@@ -177,7 +247,7 @@ def get_curr_step(graph: Graph, step_id: int) -> Tuple[int, str]:
     Ein
     ---
     graph : Graph
-        Aktive Neo4j‑Verbindung.
+        Neo4j‑Verbindung; wird nicht gelesen, da die Schritte seit ``import_steps`` im Speicher liegen.
     step_id : int
         ID des gewünschten «Step»‑Knotens.
 
@@ -187,21 +257,393 @@ def get_curr_step(graph: Graph, step_id: int) -> Tuple[int, str]:
         (Schritt‑ID, Schritt‑Beschreibung). Existiert kein Knoten mit der gegebenen ID, wird ``(step_id, "Der aktuelle Schritt existiert nicht …")`` zurückgegeben.
     """
 
-    q = """
-    MATCH (c:Step {id:$sid})
-    RETURN c.id AS id, c.description AS description
-    """
-    rst = [{"id": r["id"], "description": r["description"]} for r in graph.run(q, sid=str(step_id))]
+    rst = _lookup_step(step_id, None)
 
-    if rst == []:
+    if rst is None:
         return step_id, "Der aktuellen Schritt existiert nicht. Gehe zum letzten Schritt zurück."
 
-    return int(rst[0]["id"]), rst[0]["description"]
+    return rst
 
 # ------------------------------------------------------------------
 # Hilfsmethoden
 # ------------------------------------------------------------------
 
+def build_system_prompt(graph_doc: str = "") -> str:
+
+    """
+    Baut den System‑Prompt mit dem aktuellen Datum zusammen.
+
+    Ein
+    ---
+    graph_doc : str, optional
+        Zusätzliche Anweisungen, die dem Prompt vorangestellt werden (z. B. die ``TOOL_POLICY`` für die graphbasierte Prozessdokumentation).
+
+    Aus
+    ---
+    str
+        Vollständiger System‑Prompt; das Datum wird erst beim Aufruf eingesetzt.
+    """
+
+    return "".join([graph_doc, SYSTEM_PROMPT_TEMPLATE.format(date=datetime.now().strftime('%A, %B %#d, %Y'))])
+
+
+def _settle(action: str) -> None:
+
+    """
+    Wartet nach einer GUI‑Aktion kurz, bis die Oberfläche reagiert hat.
+
+    Ein
+    ---
+    action : str
+        Name der ausgeführten Aktion; die Wartezeit stammt aus ``SETTLE_DELAYS``.
+    """
+
+    delay = SETTLE_DELAYS.get(action, 0.0)
+    if delay:
+        time.sleep(delay)
+
+
+def _write_bytes(path: str, data: bytes) -> None:
+
+    """
+    Schreibt *data* binär nach *path*; wird im Hintergrund über ``_IO_POOL`` ausgeführt.
+
+    Ein
+    ---
+    path : str
+        Zieldatei.
+    data : bytes
+        Zu schreibender Inhalt.
+    """
+
+    with open(path, "wb") as fh:
+        fh.write(data)
+
+
+def _write_in_background(path: str, data: bytes) -> None:
+
+    """
+    Übergibt einen Schreibauftrag an ``_IO_POOL``, ohne dass sich unbegrenzt viele Aufträge stauen.
+
+    Ein
+    ---
+    path : str
+        Zieldatei.
+    data : bytes
+        Zu schreibender Inhalt.
+
+    Hinweise
+    --------
+    * Sind bereits 8 Aufträge offen, blockiert der Aufruf, bis einer davon fertig ist.
+    * Fehler beim Schreiben werden geloggt, da sie im Hintergrund‑Thread sonst verloren gingen.
+    """
+
+    _IO_SLOTS.acquire()
+    future = _IO_POOL.submit(_write_bytes, path, data)
+
+    def _done(fut):
+        _IO_SLOTS.release()
+        if fut.exception() is not None:
+            logging.error(f"Fehler beim Speichern von {path}: {fut.exception()}")
+
+    future.add_done_callback(_done)
+
+
+def _grab_screen() -> Image.Image:
+
+    """
+    Erstellt einen Screenshot des Hauptbildschirms.
+
+    Aus
+    ---
+    PIL.Image.Image
+        RGB-Bild des ersten Monitors. Nutzt die wiederverwendete ``mss``-Instanz und fällt auf ``pyautogui.screenshot()`` zurück, falls ``mss`` nicht installiert ist.
+    """
+
+    if _SCT is None:
+        return pyautogui.screenshot()
+    raw = _SCT.grab(_SCT.monitors[1])
+    return Image.frombytes("RGB", raw.size, raw.rgb)
+
+def _do_screenshot(tool_input: Dict[str, Any], graph_db: Optional[Graph]) -> Tuple[str, Any, bool]:
+
+    """
+    Erstellt einen Screenshot, speichert ihn im Hintergrund und liefert ihn Base64‑kodiert zurück.
+
+    Ein
+    ---
+    tool_input : dict[str, Any]
+        Wird nicht ausgewertet.
+    graph_db : Graph | None
+        Wird nicht genutzt; gemeinsame Signatur aller Handler in ``_HANDLERS``.
+
+    Aus
+    ---
+    tuple(str, Any, bool)
+        ``(result_type, result_data, is_error)`` wie bei ``execute_computer_tool``.
+    """
+
+    img = _grab_screen()
+    ts = int(time.time() * 1000)
+    path = os.path.join(OUTPUT_DIR, f"screenshot_{ts}.jpg")
+
+    # Nur einmal als JPEG kodieren und dieselben Bytes speichern und senden
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=82, optimize=False)
+    data = buf.getvalue()
+    # Das Speichern auf der Platte läuft parallel zum nächsten API-Call
+    _write_in_background(path, data)
+    encoded = base64.b64encode(data).decode("ascii")
+
+    logging.info(f"✔ Screenshot wird unter {path} gespeichert und an das Model in base64 gesendet")
+
+    return "image", {
+            "type": "base64",
+
+            "media_type": "image/jpeg",
+            "data": encoded
+    }, False
+
+
+def _do_mouse_move(tool_input: Dict[str, Any], graph_db: Optional[Graph]) -> Optional[Tuple[str, Any, bool]]:
+
+    """
+    Bewegt die Maus zu ``coordinate``.
+
+    Ein
+    ---
+    tool_input : dict[str, Any]
+        Benötigt **coordinate** (list[int, int]).
+    graph_db : Graph | None
+        Wird nicht genutzt; gemeinsame Signatur aller Handler in ``_HANDLERS``.
+
+    Aus
+    ---
+    tuple(str, Any, bool) | None
+        ``(result_type, result_data, is_error)`` wie bei ``execute_computer_tool``.
+        ``None``, wenn Pflichtparameter fehlen; ``execute_computer_tool`` meldet dann „Unbekannte Aktion oder fehlende Parameter“.
+    """
+
+    coord = tool_input.get("coordinate")
+    if not isinstance(coord, list):
+        return None
+    pyautogui.moveTo(*coord)
+    _settle("mouse_move")
+    return "text", "", False
+
+
+def _click_handler(button: str) -> Callable[[Dict[str, Any], Optional[Graph]], Tuple[str, Any, bool]]:
+
+    """
+    Erzeugt den Handler für ``left_click`` bzw. ``right_click``.
+
+    Ein
+    ---
+    button : str
+        ``"left"`` oder ``"right"``.
+
+    Aus
+    ---
+    Callable
+        Handler mit der Signatur ``(tool_input, graph_db)``. Er klickt an **coordinate** oder, falls diese fehlt, an der aktuellen Mausposition und liefert ``("text", "", False)``.
+    """
+
+    action = f"{button}_click"
+
+    def _do_click(tool_input: Dict[str, Any], graph_db: Optional[Graph]) -> Tuple[str, Any, bool]:
+        coord = tool_input.get("coordinate")
+        if coord:
+            pyautogui.click(coord[0], coord[1], button=button)
+        else:
+            pyautogui.click(button=button)
+        _settle(action)
+        return "text", "", False
+
+    return _do_click
+
+
+def _do_double_click(tool_input: Dict[str, Any], graph_db: Optional[Graph]) -> Tuple[str, Any, bool]:
+
+    """
+    Doppelklickt an ``coordinate`` oder an der aktuellen Mausposition.
+
+    Ein
+    ---
+    tool_input : dict[str, Any]
+        Optional **coordinate** (list[int, int]).
+    graph_db : Graph | None
+        Wird nicht genutzt; gemeinsame Signatur aller Handler in ``_HANDLERS``.
+
+    Aus
+    ---
+    tuple(str, Any, bool)
+        ``(result_type, result_data, is_error)`` wie bei ``execute_computer_tool``.
+    """
+
+    coord = tool_input.get("coordinate")
+    if coord:
+        pyautogui.doubleClick(coord[0], coord[1])
+    else:
+        pyautogui.doubleClick()
+    _settle("double_click")
+    return "text", "", False
+
+
+def _do_type(tool_input: Dict[str, Any], graph_db: Optional[Graph]) -> Optional[Tuple[str, Any, bool]]:
+
+    """
+    Tippt ``text`` ein.
+
+    Ein
+    ---
+    tool_input : dict[str, Any]
+        Benötigt **text** (str).
+    graph_db : Graph | None
+        Wird nicht genutzt; gemeinsame Signatur aller Handler in ``_HANDLERS``.
+
+    Aus
+    ---
+    tuple(str, Any, bool) | None
+        ``(result_type, result_data, is_error)`` wie bei ``execute_computer_tool``.
+        ``None``, wenn Pflichtparameter fehlen; ``execute_computer_tool`` meldet dann „Unbekannte Aktion oder fehlende Parameter“.
+    """
+
+    text = tool_input.get("text")
+    if not isinstance(text, str):
+        return None
+    pyautogui.write(text, interval=0.012)
+    _settle("type")
+    return "text", "", False
+
+
+def _do_key(tool_input: Dict[str, Any], graph_db: Optional[Graph]) -> Optional[Tuple[str, Any, bool]]:
+
+    """
+    Drückt die Taste ``text``.
+
+    Ein
+    ---
+    tool_input : dict[str, Any]
+        Benötigt **text** (str) mit dem Tastennamen.
+    graph_db : Graph | None
+        Wird nicht genutzt; gemeinsame Signatur aller Handler in ``_HANDLERS``.
+
+    Aus
+    ---
+    tuple(str, Any, bool) | None
+        ``(result_type, result_data, is_error)`` wie bei ``execute_computer_tool``.
+        ``None``, wenn Pflichtparameter fehlen; ``execute_computer_tool`` meldet dann „Unbekannte Aktion oder fehlende Parameter“.
+    """
+
+    text = tool_input.get("text")
+    if not isinstance(text, str):
+        return None
+    pyautogui.press(text)
+    _settle("key")
+    return "text", "", False
+
+
+def _do_scroll(tool_input: Dict[str, Any], graph_db: Optional[Graph]) -> Optional[Tuple[str, Any, bool]]:
+
+    """
+    Scrollt um ``scroll_amount`` in ``scroll_direction``.
+
+    Ein
+    ---
+    tool_input : dict[str, Any]
+        Benötigt **scroll_direction** (str); optional **scroll_amount** (int).
+    graph_db : Graph | None
+        Wird nicht genutzt; gemeinsame Signatur aller Handler in ``_HANDLERS``.
+
+    Aus
+    ---
+    tuple(str, Any, bool) | None
+        ``(result_type, result_data, is_error)`` wie bei ``execute_computer_tool``.
+        ``None``, wenn Pflichtparameter fehlen; ``execute_computer_tool`` meldet dann „Unbekannte Aktion oder fehlende Parameter“.
+    """
+
+    scroll_dir = tool_input.get("scroll_direction")
+    if not scroll_dir:
+        return None
+    amt = 100 * (tool_input.get("scroll_amount") or 0)
+    if scroll_dir == "up":    pyautogui.scroll(amt)
+    elif scroll_dir == "down":pyautogui.scroll(-amt)
+    elif scroll_dir == "left":pyautogui.hscroll(-amt)
+    else:                     pyautogui.hscroll(amt)
+    _settle("scroll")
+    return "text", "", False
+
+
+def _do_wait(tool_input: Dict[str, Any], graph_db: Optional[Graph]) -> Optional[Tuple[str, Any, bool]]:
+
+    """
+    Wartet ``duration`` Sekunden.
+
+    Ein
+    ---
+    tool_input : dict[str, Any]
+        Benötigt **duration** (int | float).
+    graph_db : Graph | None
+        Wird nicht genutzt; gemeinsame Signatur aller Handler in ``_HANDLERS``.
+
+    Aus
+    ---
+    tuple(str, Any, bool) | None
+        ``(result_type, result_data, is_error)`` wie bei ``execute_computer_tool``.
+        ``None``, wenn Pflichtparameter fehlen; ``execute_computer_tool`` meldet dann „Unbekannte Aktion oder fehlende Parameter“.
+    """
+
+    duration = tool_input.get("duration")
+    if not isinstance(duration, (int, float)):
+        return None
+    time.sleep(duration)
+    return "text", "", False
+
+
+def _navigation_handler(get_step: Callable[[Graph, int], Tuple[int, str]]) -> Callable[[Dict[str, Any], Optional[Graph]], Tuple[str, Any, bool]]:
+
+    """
+    Erzeugt den Handler für ``prev``, ``next`` bzw. ``curr`` auf Basis von *get_step*.
+
+    Ein
+    ---
+    get_step : Callable[[Graph, int], tuple(int, str)]
+        ``get_prev_step``, ``get_next_step`` oder ``get_curr_step``.
+
+    Aus
+    ---
+    Callable
+        Handler mit der Signatur ``(tool_input, graph_db)``. Er setzt global ``PROCESSSTEP_ID`` auf den gefundenen Schritt und liefert ``("text", Beschreibung, False)``.
+    """
+
+    def _do_navigate(tool_input: Dict[str, Any], graph_db: Optional[Graph]) -> Tuple[str, Any, bool]:
+        global PROCESSSTEP_ID
+        PROCESSSTEP_ID, description = get_step(graph_db, PROCESSSTEP_ID)
+        print(description)
+        return "text", description, False
+
+    return _do_navigate
+
+
+_HANDLERS = {
+    "screenshot": _do_screenshot,
+    "mouse_move": _do_mouse_move,
+    "left_click": _click_handler("left"),
+    "right_click": _click_handler("right"),
+    "double_click": _do_double_click,
+    "type": _do_type,
+    "key": _do_key,
+    "scroll": _do_scroll,
+    "wait": _do_wait,
+    "prev": _navigation_handler(get_prev_step),
+    "next": _navigation_handler(get_next_step),
+    "curr": _navigation_handler(get_curr_step),
+}
+_NAVIGATION_ACTIONS = {"prev", "next", "curr"}
+
+
 def execute_computer_tool(tool_input: Dict[str, Any], graph_db: Optional[Graph]) -> Tuple[str, Any, bool]:
 
     """
@@ -233,130 +675,31 @@ def execute_computer_tool(tool_input: Dict[str, Any], graph_db: Optional[Graph])
     --------
     * Erhöht global ``PROZESSSCHRITTE`` pro erfolgreicher Aktion.
     * Nutzt ``pyautogui`` für alle GUI‑Interaktionen.
+    * Die Aktion wird über ``_HANDLERS`` direkt dem passenden ``_do_*``‑Handler zugeordnet. Liefert ein Handler ``None``, fehlen Pflichtparameter; das wird wie eine unbekannte Aktion behandelt.
     * Navigations­aktionen lesen den Workflow‑Graphen und liefern dessen Beschreibungs­texte zurück.
     * Bei unbekannten Aktionen oder Ausführungs­fehlern wird ein Fehlermeldungs‑Tuple mit ``is_error = True`` zurückgegeben.
     """
 
-    global PROCESSSTEP_ID
     global PROCESSSTEP
     action = tool_input.get("action")
-    text = tool_input.get("text")
-    coord = tool_input.get("coordinate")
-    scroll_dir = tool_input.get("scroll_direction")
-    scroll_amt = tool_input.get("scroll_amount")
-    duration = tool_input.get("duration")
+    handler = _HANDLERS.get(action) if isinstance(action, str) else None
 
     try:
-        if action == "screenshot":
-            img = pyautogui.screenshot()
-            ts = int(time.time() * 1000)
-            path = os.path.join(OUTPUT_DIR, f"screenshot_{ts}.png")
-            img.save(path)
-
-            buf = BytesIO()
-            img.save(buf, format="PNG")
-            encoded = base64.b64encode(buf.getvalue()).decode()
-
-            logging.info(f"✔ Screenshot gespeichert: {path} und an das Model in base64 gesendet")
-            PROCESSSTEP += 1
-
-            return "image", {
-                    "type": "base64",
-
-                    "media_type": "image/png",
-                    "data": encoded
-            }, False
-
-        elif action == "mouse_move" and isinstance(coord, list):
-            pyautogui.moveTo(*coord)
-            time.sleep(0.2)
-            PROCESSSTEP += 1
-            return "text", "", False
-
-        elif action == "left_click":
-            if coord:
-                pyautogui.click(coord[0], coord[1], button="left")
-                time.sleep(0.2)
-            else:
-                pyautogui.click(button="left")
-                time.sleep(0.2)
-            PROCESSSTEP += 1
-            return "text", "", False
-
-
-        elif action == "right_click":
-            if coord:
-                pyautogui.click(coord[0], coord[1], button="right")
-                time.sleep(0.2)
-            else:
-                pyautogui.click(button="right")
-                time.sleep(0.2)
-            PROCESSSTEP += 1
-            return "text", "", False
-
-        elif action == "double_click":
-            if coord:
-                pyautogui.doubleClick(coord[0], coord[1])
-                time.sleep(0.2)
-            else:
-                pyautogui.doubleClick()
-                time.sleep(0.2)
-            PROCESSSTEP += 1
-            return "text", "", False
-
-
-        elif action == "type" and isinstance(text, str):
-            pyautogui.write(text, interval=0.012)
-            time.sleep(0.2)
-            PROCESSSTEP += 1
-            return "text", "", False
-
-        elif action == "key" and isinstance(text, str):
-            pyautogui.press(text)
-            time.sleep(0.2)
-            PROCESSSTEP += 1
-            return "text", "", False
-
-        elif action == "scroll" and scroll_dir:
-            amt = 100 * (scroll_amt or 0)
-            if scroll_dir == "up":    pyautogui.scroll(amt)
-            elif scroll_dir == "down":pyautogui.scroll(-amt)
-            elif scroll_dir == "left":pyautogui.hscroll(-amt)
-            else:                     pyautogui.hscroll(amt)
-            time.sleep(0.2)
-            PROCESSSTEP += 1
-            return "text", "", False
-
-        elif action == "wait" and isinstance(duration, (int, float)):
-            time.sleep(duration)
-            PROCESSSTEP += 1
-            return "text", "", False
-        
-        elif action == "prev":
-            PROCESSSTEP_ID, description = get_prev_step(graph_db, PROCESSSTEP_ID)
-            print(description)
-            return "text", description, False
-        
-        elif action == "next":
-            PROCESSSTEP_ID, description = get_next_step(graph_db, PROCESSSTEP_ID)
-            print(description)
-            return "text", description, False
-        
-        elif action == "curr":
-            PROCESSSTEP_ID, description = get_curr_step(graph_db, PROCESSSTEP_ID)
-            print(description)
-            return "text", description, False
-
-        else:
-            msg = f"Unbekannte Aktion oder fehlende Parameter: {tool_input}"
-            logging.error(msg)
-            PROCESSSTEP += 1
-            return "text", msg, True
-
+        result = handler(tool_input, graph_db) if handler is not None else None
     except Exception as e:
         logging.exception("Fehler bei Ausführung des Computer-Tools")
         return "text", str(e), True
 
+    if result is None:
+        msg = f"Unbekannte Aktion oder fehlende Parameter: {tool_input}"
+        logging.error(msg)
+        PROCESSSTEP += 1
+        return "text", msg, True
+
+    if action not in _NAVIGATION_ACTIONS:
+        PROCESSSTEP += 1
+    return result
+
 def collect_from_stream(stream) -> Tuple[List[dict], List[dict]]:
 
     """
@@ -381,7 +724,8 @@ def collect_from_stream(stream) -> Tuple[List[dict], List[dict]]:
 
     assistant_blocks, tool_requests = [], []
     open_blocks: Dict[int, dict]    = {}
-    partial_json: Dict[int, str]    = {}
+    text_parts: Dict[int, List[str]] = {}
+    partial_json: Dict[int, bytearray] = {}
 
     for ev in stream:
         etype = ev.type
@@ -390,25 +734,29 @@ def collect_from_stream(stream) -> Tuple[List[dict], List[dict]]:
             blk = ev.content_block.to_dict()
             open_blocks[ev.index] = blk
             assistant_blocks.append(blk)
-            if blk["type"] == "tool_use":
-                partial_json[ev.index] = ""
+            if blk["type"] == "text":
+                text_parts[ev.index] = [blk.get("text", "")]
+            elif blk["type"] == "tool_use":
+                partial_json[ev.index] = bytearray()
 
         elif etype == "content_block_delta":
             delta_type = ev.delta.type
             blk = open_blocks[ev.index]
 
             if delta_type == "text_delta":
-                blk["text"] = blk.get("text", "") + ev.delta.text
+                text_parts.setdefault(ev.index, [blk.get("text", "")]).append(ev.delta.text)
 
             elif delta_type == "input_json_delta":
-                partial_json[ev.index] += ev.delta.partial_json
+                partial_json[ev.index] += ev.delta.partial_json.encode()
 
         elif etype == "content_block_stop":
             blk = open_blocks[ev.index]
+            if ev.index in text_parts:
+                blk["text"] = "".join(text_parts.pop(ev.index))
             if blk["type"] == "tool_use":
                 try:
-                    blk["input"] = json.loads(partial_json[ev.index])
-                except json.JSONDecodeError:
+                    blk["input"] = _json_loads(partial_json[ev.index])
+                except ValueError:
                     blk["input"] = {}
                 tool_requests.append(blk)
 
@@ -422,32 +770,29 @@ def collect_from_stream(stream) -> Tuple[List[dict], List[dict]]:
 
     return assistant_blocks, tool_requests
 
-def strip_old_images(messages):
+def strip_old_images(image_results: List[dict]) -> None:
 
     """
-    Entfernt Base64‑Daten älterer Bilder aus User-Nachrichten, um den Tokenverbrauch zu reduzieren.
+    Entfernt ältere Bilder aus User-Nachrichten, um Tokenverbrauch und Größe der Anfragen zu reduzieren.
 
     Ein
     ---
-    messages : list[dict]
-        Nachrichten­liste im Format der Anthropic-API. Jedes Element ist ein Dict mit Schlüssel ``"content"``; ``content`` enthält eine Liste von Blöcken, u. a. ``{"type": "image", "source": {"data": "<base64>"}}``.
+    image_results : list[dict]
+        Bisher noch nicht bereinigte ``tool_result``‑Blöcke mit Bildinhalt, z. B. ``{"type": "tool_result", "content": [{"type": "image", "source": {"data": "<base64>"}}]}``. Statt den gesamten Nachrichtenverlauf zu durchsuchen, werden nur diese Blöcke angefasst.
 
     Aus
     ---
     None
-        Die Funktion liefert nichts zurück; sie überschreibt bei allen älteren Bild‑Blöcken das Feld ``"data"`` mit ``""``.
+        Die Funktion liefert nichts zurück; sie ersetzt die Bild‑Blöcke aller übergebenen ``tool_result``‑Blöcke durch einen kurzen Text‑Platzhalter und leert anschließend *image_results*. Die ``tool_use_id`` bleibt erhalten, damit die Zuordnung zum Tool‑Aufruf gültig bleibt.
     """
 
-    for msg in reversed(messages):
-        content = msg.get("content")
-        if not isinstance(content, list):
-            continue
+    for res in image_results:
+        res["content"] = [
+            dict(IMAGE_PLACEHOLDER) if blk.get("type") == "image" else blk
+            for blk in res["content"]
+        ]
 
-        for blk in reversed(content):
-            if isinstance(blk, dict) and blk.get("type") == "image":
-                src = blk.get("source") or blk
-                if isinstance(src, dict) and "data" in src:
-                    src["data"] = ""
+    image_results.clear()
 
 
 def wait_until_itpm_reset(headers: dict[str, str], ts, fudge: float = 0.5) -> None:
@@ -458,7 +803,7 @@ def wait_until_itpm_reset(headers: dict[str, str], ts, fudge: float = 0.5) -> No
     Ein
     ---
     headers : dict[str, str]
-        HTTP‑Antwort‑Header eines Anthropic‑API‑Calls. Wird nur ausgewertet, wenn *ts* nicht gesetzt ist und stattdessen der Fallback‑Header ``"retry-after"`` verwendet wird.
+        HTTP‑Antwort‑Header eines Anthropic‑API‑Calls. Der Header ``"retry-after"`` wird immer ausgewertet, da ein 429 auch vom Request‑ oder Output‑Token‑Limit stammen kann.
     ts : str | None
         ISO‑8601‑Zeitstempel (z. B. ``"2025-07-25T12:34:56Z"``), an dem das ITPM‑Kontingent zurückgesetzt wird; kann ``None`` sein.
     fudge : float, optional
@@ -467,19 +812,20 @@ def wait_until_itpm_reset(headers: dict[str, str], ts, fudge: float = 0.5) -> No
     Aus
     ---
     None
-        Die Funktion blockiert durch ``time.sleep`` und kehrt erst zurück, wenn das Kontingent sicher wieder verfügbar ist.
+        Die Funktion blockiert durch ``time.sleep`` für die längere der beiden Wartezeiten (bis *ts* bzw. laut ``"retry-after"``) zuzüglich *fudge* und kehrt erst zurück, wenn das Kontingent sicher wieder verfügbar ist.
     """
     
+    reset_wait = 0.0
     if ts:
-        reset = datetime.fromisoformat(ts.replace("Z", "+00:00"))
-        wait = (reset - datetime.now(timezone.utc)).total_seconds() + fudge
-    else:
-        try:
-            wait = float(headers.get("retry-after", "0"))
-        except ValueError:
-            wait = 0.0
+        reset = datetime.fromisoformat(ts[:-1] + "+00:00" if ts.endswith("Z") else ts)
+        reset_wait = (reset - datetime.now(timezone.utc)).total_seconds()
+
+    try:
+        retry_after = float(headers.get("retry-after", "0"))
+    except ValueError:
+        retry_after = 0.0
 
-    wait = max(0.0, wait + fudge)
+    wait = max(0.0, reset_wait, retry_after) + fudge
     wait = math.ceil(wait * 1000) / 1000
 
     print(f"Input-Bucket leer → warte {wait:.3f} s bis zur Vollauffüllung …")
@@ -541,6 +887,8 @@ def run_agent_loop(
     
     global PROCESSSTEP
     messages = [{"role": "user", "content": user_prompt}]
+    image_results: List[dict] = []
+    TIME_TO_WAIT = None
     steps = 0
 
     try:
@@ -549,7 +897,7 @@ def run_agent_loop(
 
             params = {
                 "model": model,
-                "system": system_prompt,      
+                "system": [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}],
                 "messages": messages,
                 "tools": tools,
                 "betas": betas,
@@ -562,10 +910,12 @@ def run_agent_loop(
                     stream = client.beta.messages.create(**params)
                     break
                 except anthropic.RateLimitError as e:
+                    # Der Reset-Zeitpunkt der 429-Antwort ist aktueller als der zuletzt gemerkte
+                    TIME_TO_WAIT = e.response.headers.get("anthropic-ratelimit-input-tokens-reset") or TIME_TO_WAIT
                     wait_until_itpm_reset(e.response.headers, TIME_TO_WAIT)
                     continue
 
-            TIME_TO_WAIT = stream.response.headers.get("anthropic-ratelimit-input-tokens-reset")
+            TIME_TO_WAIT = stream.response.headers.get("anthropic-ratelimit-input-tokens-reset") or TIME_TO_WAIT
             
             assistant_blocks, tool_calls = collect_from_stream(stream)
 
@@ -579,18 +929,22 @@ def run_agent_loop(
             for tc in tool_calls:
                 flag, result, is_err = execute_computer_tool(tc["input"], graph_db)
                 if flag == "image":
-                    strip_old_images(messages)
-                tool_results.append({
+                    strip_old_images(image_results)
+                tool_result = {
                     "type": "tool_result",
                     "tool_use_id": tc["id"],
                     "content":  [{"type": "image", "source": result}] if flag == "image" else result,
                     "is_error": is_err,
-                })
+                }
+                if flag == "image":
+                    image_results.append(tool_result)
+                tool_results.append(tool_result)
 
             messages.append({"role": "user", "content": tool_results})
 
-            if flag == "image":
-                messages[:] = [messages[0]] + messages[-60:]
+            # Erst ab HISTORY_TRIM_AT Nachrichten in einem Schritt auf die letzten HISTORY_KEEP kürzen
+            if len(messages) > HISTORY_TRIM_AT:
+                del messages[1:-HISTORY_KEEP]
 
             steps = i
         if steps == max_iterations:
@@ -681,6 +1035,7 @@ def main():
     }]
 
     graph = None
+    graph_doc = ""
 
     if args.graph_file:
         graph = Graph("bolt://localhost:7687", auth=("neo4j", neo4j_pw))
@@ -713,7 +1068,6 @@ def main():
         global PROCESSSTEP_ID
         PROCESSSTEP_ID = 1
 
-        global SYSTEM_PROMPT
         graph_doc = """
             <TOOL_POLICY> - Am wichtigsten!
                 1. Deine allerste Aktion ist es das Tool 'Prozessdokumentation' zu nutzen. Dieses Tool eignet sich perfekt, um zu erfahren, was für Computer Aktion du machen musst, um deine Aufgabe zu erfuellen.
@@ -726,19 +1080,22 @@ def main():
             </TOOL_POLICY>
 
         """
-        SYSTEM_PROMPT = graph_doc + SYSTEM_PROMPT
+
+    # Tool-Liste und System-Prompt sind über den Lauf konstant und werden gecacht
+    tools[-1]["cache_control"] = {"type": "ephemeral"}
 
     run_agent_loop(
         client=client,
         model=MODEL,
         tools=tools,
-        betas=[beta_flag],
-        system_prompt=SYSTEM_PROMPT,
+        betas=[beta_flag, "prompt-caching-2024-07-31"],
+        system_prompt=build_system_prompt(graph_doc),
         user_prompt=user_prompt,
         max_iterations=args.max_iterations,
         max_tokens=args.token_budget,
         graph_db=graph
     )
+    _IO_POOL.shutdown(wait=True)
     logging.info(f"Agent-Loop endgültig beendet nach {PROCESSSTEP} Computer Aktionen.")
 
     try: